@@ -2,118 +2,511 @@
 """
 master.py - Simple load balancer server
 Listens for worker connections, receives JSON load reports, and assigns tasks
-to the least-loaded worker periodically.
+to the least-loaded worker periodically. Everything runs on one thread: a
+single loop (io_uring when available, otherwise selectors) serves all worker
+sockets and assigns tasks between batches of events, so no locking is needed.
 """
 
+import heapq
+import errno
+import itertools
+import logging
+import os
+import select
+import selectors
 import socket
-import threading
-import json
 import time
+from collections import deque
+
+from messages import (Register, Load, Done, decode, FRAME_HDR, MAX_FRAME,
+                      TCP_QUICKACK, send_frame, setup_logging)
+
+try:
+    import liburing
+except ImportError:
+    # liburing is optional; without it the master uses the selectors loop
+    liburing = None
 
 HOST = "0.0.0.0"
 PORT = 5000
-LOCK = threading.Lock()
+logger = logging.getLogger("master")
+# per-connection receive buffer; compacted once less than RECV_MIN_ROOM is free
+RECV_BUF_SIZE = 65536
+RECV_MIN_ROOM = 4096
+# "uring" (io_uring when liburing is installed and the kernel supports it)
+# or "selectors"
+IO_BACKEND = os.environ.get("MASTER_IO_BACKEND", "uring")
+URING_ENTRIES = 512
+URING_BUFS = 256  # provided recv buffers of RECV_MIN_ROOM bytes each
+URING_BGID = 1
+# a queued task goes out as soon as a report drops below this load; on every
+# task tick the oldest one goes to the least-loaded worker regardless
+IDLE_LOAD = 50.0
+
+# tasks differ only in task_id, so their JSON body (a Task message) is
+# spliced from constant bytes instead of encoded; decoders accept any field order
+TASK_PREFIX = b'{"type":"task","work":"compute_pi","duration":3,"task_id":'
+TASK_SUFFIX = b'}'
+
+# worker state, one dict per field keyed by worker_id
+conns = {}        # worker_id -> socket
+last_load = {}    # worker_id -> float
+last_seen = {}    # worker_id -> time.monotonic() of last report
+current_seq = {}  # worker_id -> seq of the live load_heap entry
+
+# (last_seen, worker_id) per report, oldest first since the clock only moves
+# forward; an entry whose ts is no longer last_seen[worker_id] is outdated
+staleness_queue = deque()
+
+# task ids waiting for an idle worker; a new one is queued every TASK_INTERVAL.
+# with no workers connected the oldest are dropped past MAX_PENDING_TASKS
+TASK_INTERVAL = 5
+MAX_PENDING_TASKS = 100
+pending_tasks = deque()
+task_ids = itertools.count()
+next_task = None  # monotonic time the next task is due
+
+# min-heap of (load, seq, worker_id); an entry whose seq is no longer
+# current_seq[worker_id] is stale and skipped lazily
+load_heap = []
+_seq = itertools.count()
+
+def set_load(worker_id, load, now):
+    """
+    Record a load report. Pushes a fresh heap entry instead of updating the
+    old one in place.
+    """
+    seq = next(_seq)
+    current_seq[worker_id] = seq
+    last_load[worker_id] = load
+    if last_seen.get(worker_id) != now:
+        staleness_queue.append((now, worker_id))
+        last_seen[worker_id] = now
+    heapq.heappush(load_heap, (load, seq, worker_id))
+    # stale entries that never reach the top would pile up; rebuild when
+    # they outnumber live ones so the heap stays O(workers)
+    if len(load_heap) > 2 * len(current_seq) + 64:
+        load_heap[:] = [e for e in load_heap if current_seq.get(e[2]) == e[1]]
+        heapq.heapify(load_heap)
+
+def remove_worker(worker_id):
+    """
+    Forget a worker; its heap entries become stale.
+    """
+    del conns[worker_id]
+    del last_load[worker_id]
+    del last_seen[worker_id]
+    del current_seq[worker_id]
+
+def least_loaded():
+    """
+    Return (worker_id, load) of the least-loaded live worker, or None.
+    """
+    while load_heap:
+        load, seq, worker_id = load_heap[0]
+        if current_seq.get(worker_id) == seq:
+            return worker_id, load
+        heapq.heappop(load_heap)
+    return None
+
+# single readiness loop (epoll on Linux) driving the listener and every worker socket
+sel = selectors.DefaultSelector()
 
-# map: worker_id -> { "conn": socket, "addr": (ip,port), "last_load": float, "last_seen": ts }
-workers = {}
+class ConnState:
+    """
+    Per-connection reactor state: peer address, a reusable receive buffer
+    (bytes in [read_off, write_off) are not yet framed), and the worker id
+    once the worker has identified itself.
+    """
+    __slots__ = ("addr", "buf", "view", "read_off", "write_off", "worker_id")
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.buf = bytearray(RECV_BUF_SIZE)
+        self.view = memoryview(self.buf)
+        self.read_off = 0
+        self.write_off = 0
+        self.worker_id = None
+
+# Handlers for decoded worker messages, received at monotonic time `now`.
+# Worker sends messages like: {"type":"load", "load":12.3, "id":"worker-1"}
+
+def handle_register(msg, conn, state, now):
+    addr = state.addr
+    worker_id = msg.id or f"{addr[0]}:{addr[1]}"
+    old_id = state.worker_id
+    if old_id is not None and old_id != worker_id and conns.get(old_id) is conn:
+        # identity changed (derived by an earlier load, or re-registered):
+        # forget the old one so it does not live on as a second worker
+        remove_worker(old_id)
+    state.worker_id = worker_id
+    conns[worker_id] = conn
+    set_load(worker_id, msg.load, now)
+    logger.info("[+] Registered worker %s from %s", worker_id, addr)
 
-def recv_thread(conn, addr):
+def handle_load(msg, conn, state, now):
+    # identity is fixed once known; only a load before register derives it
+    worker_id = state.worker_id
+    if worker_id is None:
+        addr = state.addr
+        worker_id = state.worker_id = msg.id or f"{addr[0]}:{addr[1]}"
+    if worker_id not in conns:
+        # first report without register, or evicted as stale: re-attach
+        conns[worker_id] = conn
+    set_load(worker_id, msg.load, now)
+    # (optional) print status
+    # logger.debug("Load update: %s -> %.2f%%", worker_id, msg.load)
+
+def handle_done(msg, conn, state, now):
+    logger.info("[=] Worker %s completed task.", msg.id)
+
+# message type -> handler; one dict lookup per frame. decode() returns None
+# for unsupported types, which have no handler and are ignored
+HANDLERS = {Register: handle_register, Load: handle_load, Done: handle_done}
+
+def close_conn(conn, state):
     """
-    Thread to receive JSON messages from a worker.
-    Worker sends messages like: {"type":"load", "load":12.3, "id":"worker-1"}
+    Unregister a worker socket from the selector and drop it.
+    """
+    sel.unregister(conn)
+    drop_conn(conn, state)
+
+def drop_conn(conn, state):
+    """
+    Close a worker socket, dropping the worker it carried.
+    """
+    conn.close()
+    worker_id = state.worker_id
+    if worker_id:
+        # only drop the entry if it still belongs to this connection
+        if conns.get(worker_id) is conn:
+            logger.info("[-] Worker %s disconnected.", worker_id)
+            remove_worker(worker_id)
+
+def on_readable(conn, state):
+    """
+    Read what is available and handle every complete length-prefixed frame.
     """
-    worker_id = None
     try:
-        with conn:
-            while True:
-                data = conn.recv(4096)
-                if not data:
-                    break
-                try:
-                    msg = json.loads(data.decode())
-                except Exception:
-                    # ignore malformed
-                    continue
-
-                if msg.get("type") == "register":
-                    worker_id = msg.get("id") or f"{addr[0]}:{addr[1]}"
-                    with LOCK:
-                        workers[worker_id] = {"conn": conn, "addr": addr, "last_load": msg.get("load", 0.0), "last_seen": time.time()}
-                    print(f"[+] Registered worker {worker_id} from {addr}")
-                elif msg.get("type") == "load":
-                    worker_id = msg.get("id") or f"{addr[0]}:{addr[1]}"
-                    with LOCK:
-                        if worker_id not in workers:
-                            workers[worker_id] = {"conn": conn, "addr": addr, "last_load": msg.get("load", 0.0), "last_seen": time.time()}
-                        else:
-                            workers[worker_id]["last_load"] = msg.get("load", 0.0)
-                            workers[worker_id]["last_seen"] = time.time()
-                    # (optional) print status
-                    # print(f"Load update: {worker_id} -> {msg.get('load'):.2f}%")
-                elif msg.get("type") == "done":
-                    print(f"[=] Worker {msg.get('id')} completed task.")
-                else:
-                    # unsupported message
-                    pass
+        nbytes = conn.recv_into(state.view[state.write_off:])
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError as e:
+        logger.warning("Recv error: %s", e)
+        nbytes = 0
+    if not nbytes:
+        close_conn(conn, state)
+        return
+    if TCP_QUICKACK is not None:
+        conn.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+    # frames from one recv arrived together; read the clock once for all of them
+    if not feed(conn, state, nbytes, time.monotonic()):
+        close_conn(conn, state)
+
+def feed(conn, state, nbytes, now):
+    """
+    Handle every complete frame after `nbytes` new bytes landed at
+    state.write_off. Returns False if the stream is corrupt.
+    """
+    buf = state.buf
+    off = state.read_off
+    end = state.write_off + nbytes
+    unpack_from = FRAME_HDR.unpack_from
+    handler_for = HANDLERS.get
+    try:
+        while end - off >= 4:
+            # read the length in place, without slicing the header out
+            n = unpack_from(buf, off)[0]
+            if n > MAX_FRAME:
+                logger.warning("Frame of %d bytes exceeds MAX_FRAME", n)
+                return False
+            if end - off < 4 + n:
+                break
+            msg = decode(state.view[off + 4:off + 4 + n])
+            off += 4 + n
+            handler = handler_for(type(msg))
+            if handler is not None:
+                handler(msg, conn, state, now)
     except Exception as e:
-        print("Recv thread error:", e)
-    finally:
-        # remove worker on disconnect
-        if worker_id:
-            with LOCK:
-                if worker_id in workers:
-                    print(f"[-] Worker {worker_id} disconnected.")
-                    try:
-                        del workers[worker_id]
-                    except KeyError:
-                        pass
+        logger.warning("Recv error: %s", e)
+        return False
+
+    if off == end:
+        # everything consumed: start over at the front
+        off = end = 0
+    elif len(buf) - end < RECV_MIN_ROOM:
+        # running out of room: move the partial frame to the front
+        pending = end - off
+        buf[:pending] = buf[off:end]
+        off, end = 0, pending
+        if len(buf) - end < RECV_MIN_ROOM:
+            # one frame bigger than the buffer: grow it
+            state.view.release()
+            buf.extend(bytes(len(buf)))
+            state.view = memoryview(buf)
+    state.read_off = off
+    state.write_off = end
+    return True
+
+def tune_conn(conn):
+    # small control messages: no Nagle delay; keepalive catches dead peers
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
-def assign_tasks_periodically(interval=5):
+def on_accept(server, _state):
+    conn, addr = server.accept()
+    conn.setblocking(False)
+    tune_conn(conn)
+    sel.register(conn, selectors.EVENT_READ, (on_readable, ConnState(addr)))
+
+def selectors_loop(server):
     """
-    Every `interval` seconds, pick the least-loaded worker and send a task.
-    Task is a simple JSON: {"type":"task","task_id":n}
+    Serve the listener and worker sockets from the selector (epoll on Linux).
     """
-    task_counter = 0
+    def close_worker(conn):
+        try:
+            state = sel.get_key(conn).data[1]
+        except (KeyError, ValueError):
+            # already closed (fileno -1) or no longer registered
+            conn.close()
+            return
+        close_conn(conn, state)
+
+    server.setblocking(False)
+    sel.register(server, selectors.EVENT_READ, (on_accept, None))
+    due = assign_tasks(time.monotonic(), close_worker)
     while True:
-        time.sleep(interval)
-        with LOCK:
-            # drop stale workers (not seen in last 15s)
-            now = time.time()
-            stale = [wid for wid, info in workers.items() if now - info["last_seen"] > 15]
-            for s in stale:
-                print(f"[!] Removing stale worker {s}")
-                del workers[s]
-
-            if not workers:
-                print("[!] No workers available to assign task.")
-                continue
+        for key, _mask in sel.select(max(0.0, due - time.monotonic())):
+            callback, state = key.data
+            callback(key.fileobj, state)
+        due = assign_tasks(time.monotonic(), close_worker)
+
+def uring_setup():
+    """
+    Create the ring for uring_loop, or return None to use selectors instead.
+    """
+    if liburing is None or IO_BACKEND != "uring":
+        return None
+    ring = liburing.Ring()
+    try:
+        # not DEFER_TASKRUN: that only posts completions from inside
+        # io_uring_enter, and liburing's blocking waits hold the GIL and
+        # cannot time out for the next task. uring_loop idles in epoll instead.
+        liburing.io_uring_queue_init(URING_ENTRIES, ring, liburing.IORING_SETUP_SINGLE_ISSUER | liburing.IORING_SETUP_COOP_TASKRUN)
+    except OSError as e:
+        # SINGLE_ISSUER needs Linux 6.0+, and io_uring may be disabled
+        logger.info("[*] io_uring unavailable (%s); using selectors", e)
+        return None
+    logger.info("[*] Serving workers with io_uring")
+    return ring
+
+def uring_loop(server, ring):
+    """
+    Serve the listener and worker sockets from io_uring: one multishot accept,
+    one multishot recv per worker, and a provided-buffer group the kernel
+    picks recv buffers from. Completions are reaped in batches, so most
+    received frames cost no syscall of their own.
+    """
+    L = liburing
+    F_MORE = L.IORING_CQE_F_MORE
+    F_BUFFER = L.IORING_CQE_F_BUFFER
+    BUFFER_SHIFT = L.IORING_CQE_BUFFER_SHIFT
+    UD_BUF, UD_ACCEPT = 0, 1  # user_data of buffer and accept completions
+    bufs = [bytearray(RECV_MIN_ROOM) for _ in range(URING_BUFS)]
+    views = [memoryview(b) for b in bufs]
+    clients = {}  # user_data -> (conn, ConnState)
+    next_ud = itertools.count(2)
+
+    def get_sqe():
+        sqe = L.io_uring_get_sqe(ring)
+        if sqe is None:
+            # submission queue full: flush it and retry
+            L.io_uring_submit(ring)
+            sqe = L.io_uring_get_sqe(ring)
+        return sqe
+
+    def provide(bid):
+        sqe = get_sqe()
+        L.io_uring_prep_provide_buffers(sqe, bufs[bid], 1, URING_BGID, bid)
+        sqe.user_data = UD_BUF
 
-            # choose worker with min last_load
-            chosen = min(workers.items(), key=lambda kv: kv[1]["last_load"])
-            worker_id, info = chosen
+    def arm_accept():
+        sqe = get_sqe()
+        L.io_uring_prep_multishot_accept(sqe, server.fileno())
+        sqe.user_data = UD_ACCEPT
+
+    def arm_recv(conn, ud):
+        sqe = get_sqe()
+        L.io_uring_prep_recv_multishot(sqe, conn.fileno(), None, 0)
+        sqe.flags |= L.IOSQE_BUFFER_SELECT
+        L.io_uring_sqe_set_buf_group(sqe, URING_BGID)
+        sqe.user_data = ud
+
+    def close(ud):
+        conn, state = clients.pop(ud)
+        # shutdown ends the in-flight multishot recv; its last completion is ignored
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        drop_conn(conn, state)
+
+    def close_worker(conn):
+        # only after a failed send, so a scan is cheap enough
+        for ud, (c, _state) in clients.items():
+            if c is conn:
+                close(ud)
+                return
+
+    for bid in range(URING_BUFS):
+        provide(bid)
+    arm_accept()
+    # the ring fd turns readable once completions are pending; epoll also
+    # gives the timeout for the next task
+    idle = select.epoll()
+    idle.register(ring.ring_fd, select.EPOLLIN)
+    cqe = L.Cqe()
+    due = assign_tasks(time.monotonic(), close_worker)
+    while True:
+        L.io_uring_submit_and_get_events(ring)
+        if not L.io_uring_cq_ready(ring):
+            idle.poll(max(0.0, due - time.monotonic()))
+            # tasks may have come due while idle
+            due = assign_tasks(time.monotonic(), close_worker)
+            continue
+        now = time.monotonic()
+        seen = 0
+        for _ in L.CqeIter(ring, cqe):
+            seen += 1
+            entry = cqe[0]
+            ud, flags = entry.user_data, entry.flags
             try:
-                payload = {"type": "task", "task_id": task_counter, "work": "compute_pi", "duration": 3}
-                info["conn"].sendall(json.dumps(payload).encode())
-                print(f"[>] Assigned task {task_counter} to {worker_id} (load={info['last_load']:.2f}%)")
-                task_counter += 1
-            except Exception as e:
-                print(f"[!] Failed to send task to {worker_id}: {e}")
-                # remove worker if send fails
-                del workers[worker_id]
+                res = entry.res
+            except OSError as e:
+                # liburing raises for negative results
+                res = -e.errno
+            if ud == UD_BUF:
+                if res < 0:
+                    logger.error("Provide buffers error: %s", os.strerror(-res))
+                continue
+            if ud == UD_ACCEPT:
+                if res >= 0:
+                    conn = socket.socket(fileno=res)
+                    try:
+                        # task sends happen on this thread and must not block it
+                        conn.setblocking(False)
+                        tune_conn(conn)
+                        addr = conn.getpeername()
+                    except OSError as e:
+                        # peer reset between accept and now (ENOTCONN)
+                        logger.warning("Accept error: %s", e)
+                        conn.close()
+                    else:
+                        ud = next(next_ud)
+                        clients[ud] = (conn, ConnState(addr))
+                        arm_recv(conn, ud)
+                else:
+                    logger.warning("Accept error: %s", os.strerror(-res))
+                if not flags & F_MORE:
+                    arm_accept()
+                continue
+
+            if flags & F_BUFFER:
+                bid = flags >> BUFFER_SHIFT
+                if res > 0 and ud in clients:
+                    conn, state = clients[ud]
+                    # frames may straddle recvs, so bytes go to the connection buffer
+                    state.view[state.write_off:state.write_off + res] = views[bid][:res]
+                    provide(bid)
+                    if TCP_QUICKACK is not None:
+                        conn.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+                    if not feed(conn, state, res, now):
+                        close(ud)
+                        continue
+                else:
+                    provide(bid)
+            if ud not in clients:
+                # completion for a connection we already closed
+                continue
+            if res == -errno.ENOBUFS or (res > 0 and not flags & F_MORE):
+                # multishot recv stopped (e.g. ran out of buffers): re-arm it
+                arm_recv(clients[ud][0], ud)
+            elif res <= 0:
+                if res < 0:
+                    logger.warning("Recv error: %s", os.strerror(-res))
+                close(ud)
+        L.io_uring_cq_advance(ring, seen)
+        due = assign_tasks(now, close_worker)
+
+def assign_tasks(now, close_worker):
+    """
+    Queue a task if one is due (evicting stale workers on the same tick),
+    then hand queued tasks to the least-loaded worker: one per tick whatever
+    its load, any others only while it is below IDLE_LOAD. Called by the
+    I/O loop after every batch of events, with its close_worker(conn) for
+    connections a send failed on; returns when the next task is due.
+    Task is a simple JSON: {"type":"task","work":"compute_pi","duration":3,"task_id":n}
+    """
+    global next_task
+    if next_task is None:
+        next_task = now + TASK_INTERVAL
+    tick = now >= next_task
+    if tick:
+        if len(pending_tasks) >= MAX_PENDING_TASKS:
+            logger.warning("[!] Dropping task %s: queue full.", pending_tasks.popleft())
+        pending_tasks.append(next(task_ids))
+        next_task += TASK_INTERVAL
+        # drop stale workers (not seen in last 15s); only entries older than
+        # that are touched, so this is O(newly stale) rather than O(workers)
+        while staleness_queue and now - staleness_queue[0][0] > 15:
+            ts, wid = staleness_queue.popleft()
+            if last_seen.get(wid) == ts:
+                logger.warning("[!] Removing stale worker %s", wid)
+                remove_worker(wid)
+
+    while pending_tasks:
+        # choose worker with min last_load
+        chosen = least_loaded()
+        if chosen is None:
+            if tick:
+                logger.info("[!] No workers available; %d task(s) waiting.", len(pending_tasks))
+            break
+        if chosen[1] >= IDLE_LOAD and not tick:
+            break
+        worker_id, load = chosen
+        task_id = pending_tasks[0]
+        try:
+            send_frame(conns[worker_id], TASK_PREFIX + str(task_id).encode() + TASK_SUFFIX)
+        except Exception as e:
+            logger.warning("[!] Failed to send task to %s: %s", worker_id, e)
+            # part of the frame may be on the wire, so the stream is out of
+            # sync: close the connection
+            close_worker(conns[worker_id])
+            if worker_id in conns:
+                # the connection no longer carried this worker id
+                remove_worker(worker_id)
+            continue
+        pending_tasks.popleft()
+        tick = False  # the rest wait for an idle worker
+        logger.info("[>] Assigned task %s to %s (load=%.2f%%)", task_id, worker_id, load)
+        # count it as busy until its next report so the rest of the
+        # queue spreads over other workers
+        set_load(worker_id, 100.0, last_seen[worker_id])
+    return next_task
 
 def accept_loop():
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind((HOST, PORT))
     server.listen(10)
-    print(f"[*] Load balancer listening on {HOST}:{PORT}")
-    # start assigner thread
-    threading.Thread(target=assign_tasks_periodically, args=(5,), daemon=True).start()
+    logger.info("[*] Load balancer listening on %s:%s", HOST, PORT)
 
-    while True:
-        conn, addr = server.accept()
-        t = threading.Thread(target=recv_thread, args=(conn, addr), daemon=True)
-        t.start()
+    ring = uring_setup()
+    if ring is not None:
+        uring_loop(server, ring)
+    else:
+        selectors_loop(server)
 
 if __name__ == "__main__":
+    setup_logging()
     accept_loop()
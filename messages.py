@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+messages.py - Message schemas and wire helpers shared by master and worker.
+Every message is a JSON object tagged by its "type" field, e.g.
+{"type":"load","id":"worker-1","load":12.3}. Uses msgspec when installed
+(typed structs, decoded in one pass with no intermediate dict); otherwise
+falls back to plain classes over orjson/stdlib json with the same wire format.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import socket
+import struct
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Union, get_args
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    # orjson is optional; fall back to the stdlib (slower, but portable)
+    import json
+    def json_loads(data):
+        # stdlib json does not take memoryview slices of the recv buffer
+        return json.loads(bytes(data))
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+# frame length prefix (4-byte big-endian), compiled once
+FRAME_HDR = struct.Struct(">I")
+# messages are tiny; a longer length prefix means the stream is corrupt
+MAX_FRAME = 1 << 20
+# Linux only; re-armed after every read because the kernel clears it
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
+def send_frame(sock, payload):
+    """
+    Send payload as one frame: 4-byte big-endian length followed by the body.
+    """
+    hdr = FRAME_HDR.pack(len(payload))
+    # header and body go out in one writev-style syscall without being joined
+    sent = sock.sendmsg([hdr, payload])
+    if sent < len(hdr) + len(payload):
+        # short write: push out whatever is left
+        sock.sendall((hdr + payload)[sent:])
+
+def setup_logging():
+    """
+    Route log records through a queue to a background thread that does the
+    writing (to stderr), so callers only pay for a queue append. LOG_LEVEL
+    picks the level.
+    """
+    q = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(q))
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(q, handler)
+    listener.start()
+    # flush whatever is still queued on exit
+    atexit.register(listener.stop)
+
+try:
+    import msgspec
+    Struct = msgspec.Struct
+except ImportError:
+    msgspec = None
+
+    class Struct:
+        """
+        Minimal stand-in for msgspec.Struct: fields come from the class
+        annotations (class attributes are defaults), `tag` names the type.
+        Like msgspec, only decode() checks field types.
+        """
+        def __init_subclass__(cls, tag=None, **kwargs):
+            super().__init_subclass__(**kwargs)
+            cls.__struct_tag__ = tag
+            cls.__struct_fields__ = tuple(cls.__annotations__)
+            # field -> accepted types; Optional[X] unpacks to (X, NoneType)
+            cls.__struct_types__ = {
+                name: get_args(ann) or (ann,) for name, ann in cls.__annotations__.items()
+            }
+
+        def __init__(self, *args, **kwargs):
+            fields = self.__struct_fields__
+            if len(args) > len(fields):
+                raise TypeError(f"{type(self).__name__} takes at most {len(fields)} arguments")
+            for name, value in zip(fields, args):
+                setattr(self, name, value)
+            for name in fields[len(args):]:
+                if name in kwargs:
+                    setattr(self, name, kwargs.pop(name))
+                elif not hasattr(type(self), name):
+                    raise TypeError(f"Missing required argument '{name}'")
+            if kwargs:
+                raise TypeError(f"Unexpected keyword argument '{next(iter(kwargs))}'")
+
+        def __repr__(self):
+            args = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__struct_fields__)
+            return f"{type(self).__name__}({args})"
+
+class Register(Struct, tag="register"):
+    id: Optional[str] = None
+    load: float = 0.0
+
+class Load(Struct, tag="load"):
+    id: Optional[str] = None
+    load: float = 0.0
+
+class Task(Struct, tag="task"):
+    task_id: int
+    work: str = "compute_pi"
+    duration: float = 3
+
+class Done(Struct, tag="done"):
+    id: Optional[str] = None
+    task_id: Optional[int] = None
+
+Message = Union[Register, Load, Task, Done]
+
+# decode() returns a Message, or None for an object whose "type" is not one
+# of ours (peers may send types this side does not support); anything else
+# that does not match the schemas raises
+if msgspec is not None:
+    class _Tagged(msgspec.Struct):
+        type: str
+
+    # one encoder/decoder per process; decode validates against the schemas
+    encode = msgspec.json.Encoder().encode
+    _decode = msgspec.json.Decoder(Message).decode
+    _decode_tag = msgspec.json.Decoder(_Tagged).decode
+    _TAGS = frozenset(cls.__struct_config__.tag for cls in (Register, Load, Task, Done))
+
+    def decode(data):
+        try:
+            return _decode(data)
+        except msgspec.ValidationError:
+            # slow path, only for frames that failed: is it just an unknown type?
+            if _decode_tag(data).type in _TAGS:
+                raise
+            return None
+else:
+    _BY_TAG = {cls.__struct_tag__: cls for cls in (Register, Load, Task, Done)}
+
+    def encode(msg):
+        obj = {"type": msg.__struct_tag__}
+        for name in msg.__struct_fields__:
+            obj[name] = getattr(msg, name)
+        return json_dumps(obj)
+
+    def _check(cls, name, value):
+        types = cls.__struct_types__[name]
+        if float in types and type(value) is int:
+            # JSON numbers without a fraction still fill float fields
+            return float(value)
+        if type(value) not in types:
+            raise ValueError(f"Expected `{types[0].__name__}`, got `{type(value).__name__}` - at `$.{name}`")
+        return value
+
+    def decode(data):
+        obj = json_loads(data)
+        if type(obj) is not dict or type(obj.get("type")) is not str:
+            raise ValueError("Expected a message object with a `type`")
+        cls = _BY_TAG.get(obj["type"])
+        if cls is None:
+            return None
+        # unknown fields are ignored, as msgspec does
+        return cls(**{name: _check(cls, name, obj[name]) for name in cls.__struct_fields__ if name in obj})
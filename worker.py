@@ -4,110 +4,181 @@ worker.py - Worker process that registers with master, reports CPU load,
 listens for tasks, and executes simulated work.
 """
 
+import logging
 import socket
 import threading
-import json
 import time
 import os
 
+from messages import (Register, Load, Task, Done, encode, decode, FRAME_HDR,
+                      MAX_FRAME, TCP_QUICKACK, send_frame, setup_logging)
+
+try:
+    import numpy as np
+    _BUF = np.random.rand(4096).astype(np.float32)
+except ImportError:
+    # numpy is optional; "numpy" busy mode falls back to the pure-Python loop
+    np = None
+
 MASTER_HOST = "127.0.0.1"
 MASTER_PORT = 5000
+logger = logging.getLogger("worker")
 WORKER_ID = f"worker-{os.getpid()}"
+# how tasks spend their duration: "numpy" (dot products), "py" (pure-Python
+# arithmetic) or "sleep" (no CPU, just elapse the time)
+BUSY_MODES = ("numpy", "py", "sleep")
+BUSY_MODE = os.environ.get("WORKER_BUSY_MODE", "numpy")
+if BUSY_MODE == "numpy" and np is None:
+    BUSY_MODE = "py"
+# load and done messages are sent from different threads; keep frames whole
+SEND_LOCK = threading.Lock()
+
+def send_msg(sock, msg):
+    """
+    Send msg as one frame: 4-byte big-endian length followed by the JSON body.
+    """
+    payload = encode(msg)
+    with SEND_LOCK:
+        send_frame(sock, payload)
+
+def recv_exact(sock, n):
+    """
+    Read exactly n bytes from sock. Returns None if the peer closed first.
+    """
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+# /proc/stat stays open for the life of the process; each sample is one pread
+_STAT_FD = os.open("/proc/stat", os.O_RDONLY)
 
 def read_cpu_times():
     """
     Return total and idle CPU times from /proc/stat (first line).
     """
-    with open("/proc/stat", "r") as f:
-        first = f.readline()
-    parts = first.strip().split()[1:]  # skip 'cpu'
-    nums = [int(x) for x in parts]
-    total = sum(nums)
-    idle = nums[3]  # idle is the 4th field
+    buf = os.pread(_STAT_FD, 320, 0)
+    nl = buf.find(b"\n")
+    parts = buf[:nl].split()[1:]  # skip 'cpu'
+    total = 0
+    for p in parts:
+        total += int(p)
+    idle = int(parts[3])  # idle is the 4th field
     return total, idle
 
-def get_cpu_percent(interval=1.0):
+def cpu_percent(prev, cur):
     """
-    Compute CPU percent over an interval by reading /proc/stat twice.
-    Returns float percent (0..100)
+    CPU percent (0..100) between two read_cpu_times() samples.
     """
-    t1, idle1 = read_cpu_times()
-    time.sleep(interval)
-    t2, idle2 = read_cpu_times()
-    total_delta = t2 - t1
-    idle_delta = idle2 - idle1
+    total_delta = cur[0] - prev[0]
+    idle_delta = cur[1] - prev[1]
     if total_delta == 0:
         return 0.0
-    usage = (1.0 - (idle_delta / total_delta)) * 100.0
-    return usage
+    return (1.0 - (idle_delta / total_delta)) * 100.0
 
-def send_load_loop(sock):
+def send_load_loop(sock, interval=1.0):
     """
     Periodically send load to master as JSON {"type":"load","id":WORKER_ID,"load":xx}
+    Each report covers the `interval` since the previous sample, so reports
+    are never more than one interval stale.
     """
-    # initial register with a load sample
-    try:
-        initial_load = get_cpu_percent(0.5)
-    except Exception:
-        initial_load = 0.0
-    reg = {"type": "register", "id": WORKER_ID, "load": initial_load}
-    sock.sendall(json.dumps(reg).encode())
+    # initial register with a short load sample
+    prev = read_cpu_times()
+    time.sleep(0.5)
+    cur = read_cpu_times()
+    send_msg(sock, Register(id=WORKER_ID, load=cpu_percent(prev, cur)))
+    prev = cur
 
     while True:
         try:
-            load = get_cpu_percent(1.0)
-            msg = {"type": "load", "id": WORKER_ID, "load": load}
-            sock.sendall(json.dumps(msg).encode())
+            time.sleep(interval)
+            cur = read_cpu_times()
+            load = cpu_percent(prev, cur)
+            prev = cur
+            send_msg(sock, Load(id=WORKER_ID, load=load))
             # print status locally
-            print(f"[L] Sent load {load:.2f}% to master")
-            # sleep a bit (we already waited inside get_cpu_percent)
-            time.sleep(1.0)
+            logger.debug("[L] Sent load %.2f%% to master", load)
         except BrokenPipeError:
-            print("[!] Connection closed by master.")
+            logger.warning("[!] Connection closed by master.")
             break
         except Exception as e:
-            print("send_load_loop error:", e)
+            logger.error("send_load_loop error: %s", e)
             break
 
+def busy_work(dur):
+    """
+    Simulate a task by keeping the CPU busy (or sleeping) for `dur` seconds.
+    """
+    if BUSY_MODE == "sleep":
+        time.sleep(dur)
+        return
+    _now = time.monotonic
+    end = _now() + dur
+    if BUSY_MODE == "numpy":
+        buf = _BUF
+        while _now() < end:
+            # a batch of dot products per clock check
+            for _ in range(100):
+                float(buf @ buf)
+    else:
+        while _now() < end:
+            # simple math to keep CPU busy
+            _ = sum(i*i for i in range(2000))
+
 def listen_for_master(sock):
     """
-    Listen for incoming JSON messages from master (tasks).
+    Listen for incoming length-prefixed JSON messages from master (tasks).
     """
     while True:
         try:
-            data = sock.recv(4096)
-            if not data:
-                print("[!] Master closed connection.")
+            hdr = recv_exact(sock, 4)
+            if hdr is None:
+                logger.warning("[!] Master closed connection.")
+                break
+            n = FRAME_HDR.unpack(hdr)[0]
+            if n > MAX_FRAME:
+                logger.error("[!] Frame of %d bytes from master exceeds MAX_FRAME.", n)
+                break
+            body = recv_exact(sock, n)
+            if body is None:
+                logger.warning("[!] Master closed connection.")
                 break
+            if TCP_QUICKACK is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
             try:
-                msg = json.loads(data.decode())
-            except Exception:
+                msg = decode(body)
+            except Exception as e:
+                # the frame was read whole, so the stream is still in sync
+                logger.warning("[!] Ignoring bad message from master: %s", e)
                 continue
-            if msg.get("type") == "task":
-                task_id = msg.get("task_id")
-                print(f"[>] Received task {task_id}: executing simulated workload...")
+            if isinstance(msg, Task):
+                task_id = msg.task_id
+                logger.info("[>] Received task %s: executing simulated workload...", task_id)
                 # simulate CPU-heavy work: compute digits of pi or busy loop for duration seconds
-                dur = msg.get("duration", 3)
-                end = time.time() + dur
-                # busy work to consume CPU
-                while time.time() < end:
-                    # simple math to keep CPU busy
-                    _ = sum(i*i for i in range(2000))
-                print(f"[=] Task {task_id} done.")
+                dur = msg.duration
+                busy_work(dur)
+                logger.info("[=] Task %s done.", task_id)
                 # notify master
-                done_msg = {"type": "done", "id": WORKER_ID, "task_id": task_id}
                 try:
-                    sock.sendall(json.dumps(done_msg).encode())
+                    send_msg(sock, Done(id=WORKER_ID, task_id=task_id))
                 except Exception:
                     pass
         except Exception as e:
-            print("listen_for_master error:", e)
+            logger.error("listen_for_master error: %s", e)
             break
 
 def main():
+    if BUSY_MODE not in BUSY_MODES:
+        raise SystemExit(f"Unknown WORKER_BUSY_MODE {BUSY_MODE!r}; expected one of {', '.join(BUSY_MODES)}")
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.connect((MASTER_HOST, MASTER_PORT))
-    print(f"[*] Connected to master at {MASTER_HOST}:{MASTER_PORT} as {WORKER_ID}")
+    # small control messages: no Nagle delay; keepalive catches a dead master
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    logger.info("[*] Connected to master at %s:%s as %s", MASTER_HOST, MASTER_PORT, WORKER_ID)
 
     t1 = threading.Thread(target=send_load_loop, args=(sock,), daemon=True)
     t2 = threading.Thread(target=listen_for_master, args=(sock,), daemon=True)
@@ -119,7 +190,8 @@ def main():
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Exiting worker.")
+        logger.info("Exiting worker.")
 
 if __name__ == "__main__":
+    setup_logging()
     main()